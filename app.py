@@ -4,11 +4,16 @@ A simple web app allowing users to draw one verse per email,
 with an admin interface for verse management.
 """
 
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, render_template, request, session
 from flask_cors import CORS
+from flask_compress import Compress
+from flask_session import Session
+from datetime import timedelta
+import orjson
 import re
 import os
 import secrets
+import sqlite3
 
 # Import database operations
 import database
@@ -18,30 +23,85 @@ app = Flask(__name__)
 app.secret_key = secrets.token_hex(32)  # Secret key for sessions
 CORS(app)  # Enable CORS for API calls
 
+# Keep admin sessions server-side; the cookie only carries the session id.
+# The cookie lasts for the browser session, as with the default cookie
+# sessions; session files expire after 12 hours (they survive restarts).
+app.config['SESSION_TYPE'] = 'filesystem'
+app.config['SESSION_FILE_DIR'] = os.path.join(app.root_path, 'flask_session')
+app.config['SESSION_PERMANENT'] = False
+app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=12)
+Session(app)
+
+# Compress responses (brotli, else gzip) above 512 bytes
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_LEVEL'] = 5
+app.config['COMPRESS_MIN_SIZE'] = 512
+Compress(app)
+
 # Initialize database on startup
 database.init_db()
 
 
+# ============== RESPONSE HELPERS ==============
+
+def json_response(data):
+    """Serialize data to a JSON response with orjson (faster than jsonify)."""
+    return app.response_class(orjson.dumps(data), mimetype='application/json')
+
+
+def etag_matches(etag):
+    """
+    Check whether the request's If-None-Match holds etag. Flask-Compress
+    appends ':<encoding>' to the ETags it sends, so that suffix is ignored.
+    """
+    return any(
+        tag.split(':')[0] == etag
+        for tag in request.if_none_match.as_set(include_weak=True)
+    )
+
+
 # ============== EMAIL VALIDATION ==============
 
+# Compiled once at import rather than looked up on every request
+_EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
+
 def is_valid_email(email):
     """Validate email format using regex."""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
+    return _EMAIL_RE.match(email) is not None
 
 
 # ============== PAGE ROUTES ==============
 
+# Pages and static files may be cached by browsers for five minutes
+PAGE_MAX_AGE = 300
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = PAGE_MAX_AGE
+
+# The templates have no dynamic parts: render them once at startup
+with app.app_context():
+    INDEX_HTML = render_template('index.html').encode('utf-8')
+    ADMIN_HTML = render_template('admin.html').encode('utf-8')
+
+
+def html_response(body):
+    """Serve a pre-rendered page."""
+    return app.response_class(
+        body,
+        mimetype='text/html',
+        headers={'Cache-Control': f'public, max-age={PAGE_MAX_AGE}'}
+    )
+
+
 @app.route('/')
 def index():
     """Serve the homepage."""
-    return render_template('index.html')
+    return html_response(INDEX_HTML)
 
 
 @app.route('/admin')
 def admin():
     """Serve the admin page."""
-    return render_template('admin.html')
+    return html_response(ADMIN_HTML)
 
 
 # ============== USER API ROUTES ==============
@@ -56,16 +116,17 @@ def draw_verse():
     data = request.get_json()
     
     if not data or 'email' not in data:
-        return jsonify({
+        return json_response({
             'success': False,
             'error': 'Email requis'
         }), 400
     
-    email = data['email'].strip()
+    # Normalize once here; the database layer expects the canonical form
+    email = data['email'].strip().lower()
     
     # Validate email format
     if not is_valid_email(email):
-        return jsonify({
+        return json_response({
             'success': False,
             'error': 'Format d\'email invalide'
         }), 400
@@ -74,12 +135,19 @@ def draw_verse():
     result = database.draw_verse_for_user(email)
     
     if result is None:
-        return jsonify({
+        return json_response({
             'success': False,
             'error': 'Aucun verset disponible. Contactez l\'administrateur.'
         }), 404
     
-    return jsonify({
+    if result['verse'] is None:
+        # Already drawn, but the verse was removed before foreign keys existed
+        return json_response({
+            'success': False,
+            'error': 'Le verset tiré pour cet email n\'existe plus. Contactez l\'administrateur.'
+        }), 409
+    
+    return json_response({
         'success': True,
         'verse': result['verse'],
         'already_drawn': result['already_drawn']
@@ -97,7 +165,7 @@ def admin_login():
     data = request.get_json()
     
     if not data or 'username' not in data or 'password' not in data:
-        return jsonify({
+        return json_response({
             'success': False,
             'error': 'Nom d\'utilisateur et mot de passe requis'
         }), 400
@@ -107,12 +175,12 @@ def admin_login():
     if admin_id:
         session['admin_id'] = admin_id
         session['admin_logged_in'] = True
-        return jsonify({
+        return json_response({
             'success': True,
             'message': 'Connexion réussie'
         })
     
-    return jsonify({
+    return json_response({
         'success': False,
         'error': 'Identifiants incorrects'
     }), 401
@@ -122,42 +190,50 @@ def admin_login():
 def admin_logout():
     """Admin logout endpoint."""
     session.clear()
-    return jsonify({'success': True})
+    return json_response({'success': True})
 
 
 @app.route('/api/admin/check', methods=['GET'])
 def admin_check():
     """Check if admin is logged in."""
     is_logged_in = session.get('admin_logged_in', False)
-    return jsonify({'logged_in': is_logged_in})
+    return json_response({'logged_in': is_logged_in})
 
 
 @app.route('/api/admin/verses', methods=['GET'])
 def get_verses():
     """Get all verses (admin only)."""
     if not session.get('admin_logged_in'):
-        return jsonify({'success': False, 'error': 'Non autorisé'}), 401
+        return json_response({'success': False, 'error': 'Non autorisé'}), 401
     
-    verses = database.get_all_verses()
-    stats = database.get_draw_stats()
+    # Read the version before the data, so the tag is never newer than the body
+    etag = database.get_data_version()
+    if etag_matches(etag):
+        response = app.response_class(status=304)
+    else:
+        verses = database.get_all_verses()
+        stats = database.get_draw_stats()
+        response = json_response({
+            'success': True,
+            'verses': verses,
+            'stats': stats
+        })
     
-    return jsonify({
-        'success': True,
-        'verses': verses,
-        'stats': stats
-    })
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 @app.route('/api/admin/verses', methods=['POST'])
 def add_verse():
     """Add a new verse (admin only)."""
     if not session.get('admin_logged_in'):
-        return jsonify({'success': False, 'error': 'Non autorisé'}), 401
+        return json_response({'success': False, 'error': 'Non autorisé'}), 401
     
     data = request.get_json()
     
     if not data or 'text' not in data or 'reference' not in data:
-        return jsonify({
+        return json_response({
             'success': False,
             'error': 'Texte et référence requis'
         }), 400
@@ -166,14 +242,14 @@ def add_verse():
     reference = data['reference'].strip()
     
     if not text or not reference:
-        return jsonify({
+        return json_response({
             'success': False,
             'error': 'Le texte et la référence ne peuvent pas être vides'
         }), 400
     
     verse_id = database.add_verse(text, reference)
     
-    return jsonify({
+    return json_response({
         'success': True,
         'verse_id': verse_id,
         'message': 'Verset ajouté avec succès'
@@ -184,17 +260,24 @@ def add_verse():
 def delete_verse(verse_id):
     """Delete a verse (admin only)."""
     if not session.get('admin_logged_in'):
-        return jsonify({'success': False, 'error': 'Non autorisé'}), 401
+        return json_response({'success': False, 'error': 'Non autorisé'}), 401
     
-    deleted = database.delete_verse(verse_id)
+    try:
+        deleted = database.delete_verse(verse_id)
+    except sqlite3.IntegrityError:
+        # Foreign keys are enforced: a verse already drawn by a user stays
+        return json_response({
+            'success': False,
+            'error': 'Ce verset a déjà été tiré et ne peut pas être supprimé'
+        }), 409
     
     if deleted:
-        return jsonify({
+        return json_response({
             'success': True,
             'message': 'Verset supprimé'
         })
     
-    return jsonify({
+    return json_response({
         'success': False,
         'error': 'Verset non trouvé'
     }), 404
@@ -202,6 +285,7 @@ def delete_verse(verse_id):
 
 # ============== RUN APPLICATION ==============
 
+# Development server only; production runs under gunicorn (see Procfile)
 if __name__ == '__main__':
     print("=" * 50)
     print("🙏 Bible Verse Drawing Application")
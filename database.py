@@ -5,152 +5,335 @@ Handles SQLite database initialization and CRUD operations.
 
 import sqlite3
 import os
+import queue
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import random
+from urllib.request import pathname2url
 
 # Database file path
 DB_PATH = os.path.join(os.path.dirname(__file__), 'verset.db')
 
+# Number of read-only connections shared by request threads
+READ_POOL_SIZE = os.cpu_count() or 4
 
-def get_connection():
-    """Create and return a database connection."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row  # Enable column access by name
+# Prepared statements kept per connection (sqlite3 default is 128)
+STATEMENT_CACHE_SIZE = 256
+
+# Password hashing cost, chosen explicitly rather than inherited from
+# werkzeug (3.0.1 defaults to scrypt:32768:8:1, ~85 ms per check). Doubling
+# scrypt's N keeps it memory-hard and puts a login check near 250 ms
+# (~270 ms measured). Only applies to newly created admin rows.
+PASSWORD_HASH_METHOD = 'scrypt:65536:8:1'
+
+
+# Per-connection settings (journal_mode=WAL is persistent, set in init_db)
+CONNECTION_PRAGMAS = '''
+    PRAGMA synchronous=NORMAL;
+    PRAGMA busy_timeout=5000;
+    PRAGMA cache_size=-20000;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA foreign_keys=ON;
+'''
+
+# Queries run on the request path. Each is a parameterized constant so the
+# per-connection statement cache reuses its prepared statement.
+SQL_GET_ALL_VERSES = 'SELECT id, text, reference, created_at FROM verses ORDER BY id DESC'
+SQL_GET_VERSE = 'SELECT id, text, reference FROM verses WHERE id = ?'
+SQL_INSERT_VERSE = 'INSERT INTO verses (text, reference) VALUES (?, ?)'
+SQL_DELETE_VERSE = 'DELETE FROM verses WHERE id = ?'
+SQL_GET_USER_DRAW = '''
+    SELECT v.id, v.text, v.reference, ud.drawn_at
+    FROM user_draws ud
+    JOIN verses v ON ud.verse_id = v.id
+    WHERE ud.email = ?
+'''
+SQL_INSERT_USER_DRAW = 'INSERT OR IGNORE INTO user_draws (email, verse_id) VALUES (?, ?)'
+SQL_GET_ADMIN = 'SELECT id, password_hash FROM admin WHERE username = ?'
+SQL_GET_COUNTS = 'SELECT k, v FROM meta'
+
+# Row shapes for the queries above, lighter than sqlite3.Row; converted to
+# dicts with _asdict() only where they are returned to the API
+VerseRow = namedtuple('VerseRow', 'id text reference')
+DrawnVerseRow = namedtuple('DrawnVerseRow', 'id text reference drawn_at')
+AdminRow = namedtuple('AdminRow', 'id password_hash')
+
+
+def get_connection(read_only=False):
+    """
+    Open a new database connection with the standard pragmas applied.
+    Connections are in autocommit mode: write_conn() issues the transactions.
+    """
+    if read_only:
+        target = 'file:' + pathname2url(os.path.abspath(DB_PATH)) + '?mode=ro'
+    else:
+        target = DB_PATH
+    conn = sqlite3.connect(target, uri=read_only, check_same_thread=False,
+                           isolation_level=None,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    conn.executescript(CONNECTION_PRAGMAS)
     return conn
 
 
-def init_db():
-    """Initialize the database with required tables."""
-    conn = get_connection()
+# Readers share a pool of read-only connections (concurrent under WAL);
+# all writes go through a single connection, serialized by a lock.
+# The lock is re-entrant: writers keep holding it after commit while they
+# update the in-memory cache below.
+_read_pool = None
+_read_pool_lock = threading.Lock()
+_write_conn = None
+_write_lock = threading.RLock()
+
+# In-memory copies of the verse list and row counts. They are only
+# loaded, invalidated or updated while holding _write_lock, so a load can
+# never race with a commit.
+# These caches (and _admin_cache below) are per process and nothing
+# invalidates them across processes: the app must run as a single process
+# (gunicorn -w 1, see Procfile), or other workers serve stale verses.
+_verses_cache = None   # tuple of verse dicts, newest first
+_verses_version = 0    # bumped on every verse insert/delete
+_cache_epoch = os.urandom(4).hex()  # tells versions from different runs apart
+_counts = None         # {'draws': n, 'verses': n} from the meta table, None until loaded
+
+# AdminRow by username; filled on first login
+_admin_cache = {}
+
+
+def _get_read_pool():
+    """Return the read pool, filling it on first use (after init_db)."""
+    global _read_pool
+    if _read_pool is None:
+        with _read_pool_lock:
+            if _read_pool is None:
+                pool = queue.Queue()
+                for _ in range(READ_POOL_SIZE):
+                    pool.put(get_connection(read_only=True))
+                _read_pool = pool
+    return _read_pool
+
+
+@contextmanager
+def read_conn():
+    """Borrow a read-only connection from the pool."""
+    pool = _get_read_pool()
+    conn = pool.get()
+    try:
+        yield conn
+    finally:
+        pool.put(conn)
+
+
+def _get_write_conn():
+    """Return the write connection, opening it on first use (hold _write_lock)."""
+    global _write_conn
+    if _write_conn is None:
+        _write_conn = get_connection()
+    return _write_conn
+
+
+@contextmanager
+def write_conn():
+    """
+    Hold the single write connection for one BEGIN IMMEDIATE transaction.
+    Taking the write lock up front means a transaction never has to upgrade.
+    Commits on success and rolls back if an exception is raised.
+    """
+    with _write_lock:
+        conn = _get_write_conn()
+        conn.execute('BEGIN IMMEDIATE')
+        with conn:
+            yield conn
+
+
+def _fetch_one(conn, row_class, sql, params):
+    """Run a query and return its first row as a row_class, or None."""
     cursor = conn.cursor()
+    cursor.row_factory = lambda _cursor, row: row_class(*row)
+    return cursor.execute(sql, params).fetchone()
+
+
+# ============== IN-MEMORY CACHE ==============
+
+def _load_verses():
+    """Return all verses (newest first), reading the database only on a miss."""
+    global _verses_cache
+    verses = _verses_cache
+    if verses is None:
+        with _write_lock:
+            if _verses_cache is None:
+                with read_conn() as conn:
+                    cursor = conn.execute(SQL_GET_ALL_VERSES)
+                    _verses_cache = tuple(
+                        {'id': id_, 'text': text, 'reference': reference, 'created_at': created_at}
+                        for id_, text, reference, created_at in cursor.fetchall()
+                    )
+            verses = _verses_cache
+    return verses
+
+
+def _invalidate_verses():
+    """Drop the cached verses and counts; call with _write_lock held, after commit."""
+    global _verses_cache, _verses_version, _counts
+    _verses_cache = None
+    _verses_version += 1
+    _counts = None
+
+
+def _load_counts():
+    """Return the draw and verse counts, reading the meta table only on a miss."""
+    global _counts
+    counts = _counts
+    if counts is None:
+        with _write_lock:
+            if _counts is None:
+                with read_conn() as conn:
+                    _counts = dict(conn.execute(SQL_GET_COUNTS).fetchall())
+            counts = _counts
+    return counts
+
+
+# Tables and indexes, created together in one transaction by init_db
+SCHEMA = '''
+    -- Verses available for drawing
+    CREATE TABLE IF NOT EXISTS verses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        text TEXT NOT NULL,
+        reference TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
     
-    # Create verses table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS verses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            text TEXT NOT NULL,
-            reference TEXT NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    -- Tracks which user drew which verse
+    CREATE TABLE IF NOT EXISTS user_draws (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT UNIQUE NOT NULL,
+        verse_id INTEGER NOT NULL,
+        drawn_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (verse_id) REFERENCES verses(id)
+    );
     
-    # Create user_draws table (tracks which user drew which verse)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_draws (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE NOT NULL,
-            verse_id INTEGER NOT NULL,
-            drawn_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (verse_id) REFERENCES verses(id)
-        )
-    ''')
+    -- email is UNIQUE (already indexed); index the foreign key too, used by
+    -- the foreign key check when a verse is deleted
+    CREATE INDEX IF NOT EXISTS idx_user_draws_verse_id ON user_draws(verse_id);
     
-    # Create admin table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS admin (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL
-        )
-    ''')
+    -- Admin accounts
+    CREATE TABLE IF NOT EXISTS admin (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL
+    );
     
-    # Insert default admin if not exists
-    cursor.execute('SELECT COUNT(*) FROM admin')
-    if cursor.fetchone()[0] == 0:
-        password_hash = generate_password_hash('admin123')
-        cursor.execute(
-            'INSERT INTO admin (username, password_hash) VALUES (?, ?)',
-            ('admin', password_hash)
-        )
+    -- Row counts kept up to date by the triggers below, so the stats never
+    -- need a COUNT(*) scan. Each counter is seeded once from the table.
+    CREATE TABLE IF NOT EXISTS meta (
+        k TEXT PRIMARY KEY,
+        v INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT INTO meta (k, v) SELECT 'draws', (SELECT COUNT(*) FROM user_draws)
+        WHERE NOT EXISTS (SELECT 1 FROM meta WHERE k = 'draws');
+    INSERT INTO meta (k, v) SELECT 'verses', (SELECT COUNT(*) FROM verses)
+        WHERE NOT EXISTS (SELECT 1 FROM meta WHERE k = 'verses');
     
-    # Insert some sample verses if none exist
-    cursor.execute('SELECT COUNT(*) FROM verses')
-    if cursor.fetchone()[0] == 0:
-        sample_verses = [
-            ("Car Dieu a tant aimé le monde qu'il a donné son Fils unique, afin que quiconque croit en lui ne périsse point, mais qu'il ait la vie éternelle.", "Jean 3:16"),
-            ("L'Éternel est mon berger: je ne manquerai de rien.", "Psaume 23:1"),
-            ("Je puis tout par celui qui me fortifie.", "Philippiens 4:13"),
-            ("Confie-toi en l'Éternel de tout ton cœur, Et ne t'appuie pas sur ta sagesse.", "Proverbes 3:5"),
-            ("Car je connais les projets que j'ai formés sur vous, dit l'Éternel, projets de paix et non de malheur, afin de vous donner un avenir et de l'espérance.", "Jérémie 29:11"),
-            ("Ne crains point, car je suis avec toi; Ne promène pas des regards inquiets, car je suis ton Dieu.", "Ésaïe 41:10"),
-            ("Venez à moi, vous tous qui êtes fatigués et chargés, et je vous donnerai du repos.", "Matthieu 11:28"),
-            ("L'amour est patient, il est plein de bonté; l'amour n'est point envieux; l'amour ne se vante point.", "1 Corinthiens 13:4"),
-        ]
-        cursor.executemany(
-            'INSERT INTO verses (text, reference) VALUES (?, ?)',
-            sample_verses
-        )
+    CREATE TRIGGER IF NOT EXISTS trg_user_draws_insert AFTER INSERT ON user_draws
+    BEGIN UPDATE meta SET v = v + 1 WHERE k = 'draws'; END;
+    CREATE TRIGGER IF NOT EXISTS trg_user_draws_delete AFTER DELETE ON user_draws
+    BEGIN UPDATE meta SET v = v - 1 WHERE k = 'draws'; END;
+    CREATE TRIGGER IF NOT EXISTS trg_verses_insert AFTER INSERT ON verses
+    BEGIN UPDATE meta SET v = v + 1 WHERE k = 'verses'; END;
+    CREATE TRIGGER IF NOT EXISTS trg_verses_delete AFTER DELETE ON verses
+    BEGIN UPDATE meta SET v = v - 1 WHERE k = 'verses'; END;
+'''
+
+
+def init_db():
+    """Initialize the database with required tables."""
+    with _write_lock:
+        conn = _get_write_conn()
+        
+        # WAL lets readers run alongside the writer; the mode is stored in the file
+        conn.execute('PRAGMA journal_mode=WAL')
+        
+        conn.executescript('BEGIN IMMEDIATE;' + SCHEMA + 'COMMIT;')
     
-    conn.commit()
-    conn.close()
+    # Seed data in a second transaction; existence probes stop at the first row
+    with write_conn() as conn:
+        cursor = conn.cursor()
+        
+        # Insert default admin if not exists
+        cursor.execute('SELECT 1 FROM admin LIMIT 1')
+        if cursor.fetchone() is None:
+            password_hash = generate_password_hash('admin123', method=PASSWORD_HASH_METHOD)
+            cursor.execute(
+                'INSERT INTO admin (username, password_hash) VALUES (?, ?)',
+                ('admin', password_hash)
+            )
+        
+        # Insert some sample verses if none exist
+        cursor.execute('SELECT 1 FROM verses LIMIT 1')
+        if cursor.fetchone() is None:
+            sample_verses = [
+                ("Car Dieu a tant aimé le monde qu'il a donné son Fils unique, afin que quiconque croit en lui ne périsse point, mais qu'il ait la vie éternelle.", "Jean 3:16"),
+                ("L'Éternel est mon berger: je ne manquerai de rien.", "Psaume 23:1"),
+                ("Je puis tout par celui qui me fortifie.", "Philippiens 4:13"),
+                ("Confie-toi en l'Éternel de tout ton cœur, Et ne t'appuie pas sur ta sagesse.", "Proverbes 3:5"),
+                ("Car je connais les projets que j'ai formés sur vous, dit l'Éternel, projets de paix et non de malheur, afin de vous donner un avenir et de l'espérance.", "Jérémie 29:11"),
+                ("Ne crains point, car je suis avec toi; Ne promène pas des regards inquiets, car je suis ton Dieu.", "Ésaïe 41:10"),
+                ("Venez à moi, vous tous qui êtes fatigués et chargés, et je vous donnerai du repos.", "Matthieu 11:28"),
+                ("L'amour est patient, il est plein de bonté; l'amour n'est point envieux; l'amour ne se vante point.", "1 Corinthiens 13:4"),
+            ]
+            cursor.executemany(SQL_INSERT_VERSE, sample_verses)
 
 
 # ============== VERSE OPERATIONS ==============
 
 def get_all_verses():
     """Get all verses from the database."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, text, reference, created_at FROM verses ORDER BY id DESC')
-    verses = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return verses
+    return list(_load_verses())
 
 
 def add_verse(text, reference):
     """Add a new verse to the database."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        'INSERT INTO verses (text, reference) VALUES (?, ?)',
-        (text, reference)
-    )
-    verse_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return verse_id
+    with _write_lock:
+        with write_conn() as conn:
+            cursor = conn.execute(SQL_INSERT_VERSE, (text, reference))
+        _invalidate_verses()
+    return cursor.lastrowid
 
 
 def delete_verse(verse_id):
     """Delete a verse by its ID."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM verses WHERE id = ?', (verse_id,))
-    deleted = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
-    return deleted
+    with _write_lock:
+        with write_conn() as conn:
+            cursor = conn.execute(SQL_DELETE_VERSE, (verse_id,))
+        _invalidate_verses()
+    return cursor.rowcount > 0
 
 
 def get_verse_by_id(verse_id):
     """Get a specific verse by ID."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, text, reference FROM verses WHERE id = ?', (verse_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+    with read_conn() as conn:
+        row = _fetch_one(conn, VerseRow, SQL_GET_VERSE, (verse_id,))
+    return row._asdict() if row else None
 
 
 # ============== USER DRAW OPERATIONS ==============
 
+def _fetch_user_draw(conn, email):
+    """Return the verse row already drawn for email, or None."""
+    return _fetch_one(conn, DrawnVerseRow, SQL_GET_USER_DRAW, (email,))
+
+
 def check_user_draw(email):
     """
     Check if a user has already drawn a verse.
+    Expects a normalized (stripped, lowercased) email.
     Returns the verse if already drawn, None otherwise.
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT v.id, v.text, v.reference, ud.drawn_at
-        FROM user_draws ud
-        JOIN verses v ON ud.verse_id = v.id
-        WHERE ud.email = ?
-    ''', (email.lower(),))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+    with read_conn() as conn:
+        row = _fetch_user_draw(conn, email)
+    return row._asdict() if row else None
 
 
 def draw_verse_for_user(email):
@@ -158,40 +341,49 @@ def draw_verse_for_user(email):
     Draw a random verse for a user.
     If user already has a verse, return that verse with already_drawn=True.
     Otherwise, draw a new random verse and save it.
+    Expects a normalized (stripped, lowercased) email.
+    If the user's earlier draw points at a deleted verse, the verse is None.
     """
-    email = email.lower().strip()
-    
-    # Check if user already drew
-    existing = check_user_draw(email)
-    if existing:
-        return {
-            'verse': existing,
-            'already_drawn': True
-        }
-    
-    # Get all available verses
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, text, reference FROM verses')
-    verses = cursor.fetchall()
-    
-    if not verses:
-        conn.close()
-        return None
-    
-    # Pick a random verse
-    chosen = random.choice(verses)
-    
-    # Save the draw
-    cursor.execute(
-        'INSERT INTO user_draws (email, verse_id) VALUES (?, ?)',
-        (email, chosen['id'])
-    )
-    conn.commit()
-    conn.close()
+    # Check, pick and save in one BEGIN IMMEDIATE transaction so that two
+    # concurrent requests for the same email cannot both draw a verse
+    with _write_lock:
+        with write_conn() as conn:
+            existing = _fetch_user_draw(conn, email)
+            if existing:
+                return {
+                    'verse': existing._asdict(),
+                    'already_drawn': True
+                }
+            
+            # Pick from the cached verse list: no query unless it changed.
+            # The draw is not security-sensitive, so the shared module-level
+            # Mersenne Twister is used rather than secrets/SystemRandom; the
+            # stdlib reseeds it in forked worker processes.
+            verses = _load_verses()
+            if not verses:
+                return None
+            chosen = random.choice(verses)
+            
+            # The UNIQUE email constraint settles any race with another writer.
+            # The existing draw may also point at a verse that no longer
+            # exists (saved before foreign keys were enforced): verse is None.
+            cursor = conn.execute(SQL_INSERT_USER_DRAW, (email, chosen['id']))
+            if cursor.rowcount == 0:
+                existing = _fetch_user_draw(conn, email)
+                return {
+                    'verse': existing._asdict() if existing else None,
+                    'already_drawn': True
+                }
+        
+        if _counts is not None:
+            _counts['draws'] += 1
     
     return {
-        'verse': dict(chosen),
+        'verse': {
+            'id': chosen['id'],
+            'text': chosen['text'],
+            'reference': chosen['reference']
+        },
         'already_drawn': False
     }
 
@@ -200,30 +392,33 @@ def draw_verse_for_user(email):
 
 def verify_admin(username, password):
     """Verify admin credentials."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        'SELECT id, password_hash FROM admin WHERE username = ?',
-        (username,)
-    )
-    row = cursor.fetchone()
-    conn.close()
+    admin = _admin_cache.get(username)
+    if admin is None:
+        with read_conn() as conn:
+            admin = _fetch_one(conn, AdminRow, SQL_GET_ADMIN, (username,))
+        if admin is None:
+            return None
+        # Only existing accounts are cached, so unknown names cannot grow it
+        _admin_cache[username] = admin
     
-    if row and check_password_hash(row['password_hash'], password):
-        return row['id']
+    admin_id, password_hash = admin
+    if check_password_hash(password_hash, password):
+        return admin_id
     return None
 
 
 def get_draw_stats():
     """Get statistics about draws."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) as total FROM user_draws')
-    total_draws = cursor.fetchone()['total']
-    cursor.execute('SELECT COUNT(*) as total FROM verses')
-    total_verses = cursor.fetchone()['total']
-    conn.close()
+    counts = _load_counts()
     return {
-        'total_draws': total_draws,
-        'total_verses': total_verses
+        'total_draws': counts['draws'],
+        'total_verses': counts['verses']
     }
+
+
+def get_data_version():
+    """
+    Return a token that changes whenever verses are added or deleted or a
+    new draw is saved, for use as the ETag of the admin verse list.
+    """
+    return f"{_cache_epoch}-{_verses_version}-{_load_counts()['draws']}"